@@ -1,18 +1,32 @@
 import os
 import re
+import asyncio
+import atexit
 import sys
 import shlex
 import json
 import math
+import operator
+import ast
 import time
 import threading
+import queue
+import functools
+import concurrent.futures
 import platform
+import types
 import subprocess
+import shutil
+import webbrowser
 from pathlib import Path
+from urllib.parse import quote, quote_plus
+from collections import OrderedDict
 from datetime import datetime
-from typing import Optional
+from typing import AsyncIterator, Iterator, Optional, Union
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Optional libs (not required)
 try:
@@ -30,6 +44,38 @@ try:
 except Exception:
     pyautogui = None
 
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+try:
+    import httpx
+except Exception:
+    httpx = None
+
+try:
+    import diskcache
+except Exception:
+    diskcache = None
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+try:
+    import h2  # noqa: F401  (lets httpx speak HTTP/2)
+    _HTTP2 = True
+except Exception:
+    _HTTP2 = False
+
+_json_loads = orjson.loads if orjson else json.loads
+
+_PLATFORM = platform.system()
+_IS_WINDOWS = _PLATFORM == "Windows"
+_IS_DARWIN = _PLATFORM == "Darwin"
+
 # ---------------------------
 # CONFIG - edit or use env vars
 # ---------------------------
@@ -42,32 +88,105 @@ CONFIG = {
     "LOCAL_MUSIC_MAP": {},  # optional map name->path
     "TTS_ENABLED": pyttsx3 is not None,
     "WIKI_FALLBACK": True,
+    "AI_CACHE_TTL": float(os.environ.get("JARVIS_AI_CACHE_TTL", "3600")),  # seconds; 0 disables
+    "AI_CACHE_SIZE": 512,
+    "AI_STREAM": os.environ.get("JARVIS_AI_STREAM", "false").lower() == "true",  # stream AI replies in chunks
+    "AI_COALESCE": os.environ.get("JARVIS_AI_COALESCE", "true").lower() == "true",  # share identical in-flight AI calls
+    # Temperature 0 makes AI answers repeatable, so they are also persisted in the disk cache
+    "AI_DETERMINISTIC": os.environ.get("JARVIS_AI_DETERMINISTIC", "false").lower() == "true",
+    "DISK_CACHE_DIR": str(Path.home() / ".vex" / "wiki"),
+    "DISK_CACHE_TTL": 86400 * 7,
+    # Reuse answers for paraphrased prompts (needs sentence-transformers + ~23MB model download)
+    "SEMANTIC_CACHE": os.environ.get("JARVIS_SEMANTIC_CACHE", "false").lower() == "true",
+    "SEMANTIC_MODEL": "all-MiniLM-L6-v2",
+    "SEMANTIC_THRESHOLD": 0.9,
+    "SEMANTIC_CACHE_SIZE": 1024,
 }
 
+_CONFIRM_TOKEN = CONFIG["CONFIRM_TOKEN"] or ""
+_CONFIRM_MSG = f"Action requires confirmation. Append the confirmation token '{_CONFIRM_TOKEN}' to your command to proceed."
+
+# ---------------------------
+# Precompiled patterns
+# ---------------------------
+_RE_MOVE = re.compile(r"move\s+(.+?)\s+to\s+(.+)", re.I)
+_MATH_TRANS = str.maketrans("", "", "0123456789.+-*/%()^e \t\n")  # deletes math-only chars
+_RE_MATHFUNC = re.compile(r"\b(sin|cos|tan|log|sqrt|pi|e)\b")
+_RE_SCHEME = re.compile(r"^[a-zA-Z]+://")
+_RE_WIKI_PREFIX = re.compile(r"^(who is|what is|define|tell me about)\s+")
+
+# ---------------------------
+# HTTP session (shared keep-alive pool for AI / Wikipedia calls)
+# ---------------------------
+_SESSION = requests.Session()
+_SESSION.headers.update({"Connection": "keep-alive", "User-Agent": "Vex-AI-Assistant/1.0"})
+for _scheme in ("http://", "https://"):
+    _SESSION.mount(
+        _scheme,
+        HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=Retry(total=2, backoff_factor=0.2)),
+    )
+atexit.register(_SESSION.close)
+
 # ---------------------------
 # TTS setup (optional)
 # ---------------------------
-VOICE_LOCK = threading.Lock()
-if pyttsx3 and CONFIG["TTS_ENABLED"]:
-    _engine = pyttsx3.init()
+@functools.lru_cache(maxsize=None)
+def _get_engine():
+    """Create the TTS engine once, on first use, so importing this module (e.g. from the
+    web server, which never speaks) doesn't pay for the engine/COM startup."""
+    if not (pyttsx3 and CONFIG["TTS_ENABLED"]):
+        return None
+    try:
+        engine = pyttsx3.init()
+    except Exception:
+        return None
     try:
-        _engine.setProperty("rate", 160)
+        engine.setProperty("rate", 160)
     except Exception:
         pass
-else:
-    _engine = None
+    return engine
+
+
+# All speech goes through one worker thread: the system TTS engines are not thread-safe.
+_TTS_Q: "queue.Queue[tuple]" = queue.Queue()  # (text, done_event or None)
+_TTS_THREAD: Optional[threading.Thread] = None
+_TTS_START_LOCK = threading.Lock()
+
+
+def _tts_worker() -> None:
+    engine = _get_engine()
+    while True:
+        text, done = _TTS_Q.get()
+        try:
+            if engine:
+                engine.say(text)
+                engine.runAndWait()
+        except Exception:
+            pass
+        finally:
+            if done:
+                done.set()
+
+
+def _start_tts_worker() -> None:
+    global _TTS_THREAD
+    with _TTS_START_LOCK:
+        if _TTS_THREAD is None:
+            _TTS_THREAD = threading.Thread(target=_tts_worker, name="vex-tts", daemon=True)
+            _TTS_THREAD.start()
 
 
-def speak(text: str, block: bool = True) -> None:
-    """Speak text (if TTS available) and print to console."""
+def speak(text: str, block: bool = False) -> None:
+    """Print text and queue it for speech (if TTS available). block=True waits until spoken."""
     if not text:
         return
     print("Vex:", text)
-    if _engine:
-        with VOICE_LOCK:
-            _engine.say(text)
-            if block:
-                _engine.runAndWait()
+    if pyttsx3 and CONFIG["TTS_ENABLED"]:
+        _start_tts_worker()
+        done = threading.Event() if block else None
+        _TTS_Q.put((text, done))
+        if done:
+            done.wait()
 
 
 # ---------------------------
@@ -75,18 +194,17 @@ def speak(text: str, block: bool = True) -> None:
 # ---------------------------
 def open_website(url: str) -> str:
     """Open a URL in the default browser. If plain text, treat as search."""
-    import webbrowser
     url = url.strip()
     if not url:
         return "No URL provided."
     # If it looks like a search phrase (no dot, spaces), perform Google search
     if " " in url or (("." not in url) and ("/" not in url)):
-        query = requests.utils.requote_uri(url)
+        query = quote_plus(url)
         search_url = f"https://www.google.com/search?q={query}"
         webbrowser.open(search_url)
         return f"Searching web for: {url}"
     # Ensure scheme
-    if not re.match(r"^[a-zA-Z]+://", url):
+    if not _RE_SCHEME.match(url):
         url = "https://" + url
     try:
         webbrowser.open(url)
@@ -105,9 +223,9 @@ def open_local(path_or_app: str) -> str:
     p = Path(path_or_app).expanduser()
     if p.exists():
         try:
-            if platform.system() == "Windows":
+            if _IS_WINDOWS:
                 os.startfile(str(p))
-            elif platform.system() == "Darwin":
+            elif _IS_DARWIN:
                 subprocess.call(["open", str(p)])
             else:
                 subprocess.call(["xdg-open", str(p)])
@@ -117,8 +235,9 @@ def open_local(path_or_app: str) -> str:
 
     # Otherwise, attempt to run as app/command
     try:
-        if platform.system() == "Windows":
-            subprocess.Popen(shlex.split(path_or_app), shell=True)
+        if _IS_WINDOWS:
+            # Popen takes the raw command line on Windows; shlex's POSIX rules would mangle backslashes
+            subprocess.Popen(path_or_app)
         else:
             subprocess.Popen(shlex.split(path_or_app))
         return f"Launching {path_or_app}"
@@ -140,7 +259,7 @@ def play_music(query: str) -> str:
     if p.exists():
         return open_local(str(p))
     # search YouTube
-    query = requests.utils.requote_uri(q)
+    query = quote_plus(q)
     url = f"https://www.youtube.com/results?search_query={query}"
     return open_website(url)
 
@@ -181,10 +300,10 @@ def clipboard_paste() -> str:
 # ---------------------------
 # Safe math evaluator using AST
 # ---------------------------
-import ast
-
 _ALLOWED_NAMES = {k: getattr(math, k) for k in dir(math) if not k.startswith("_")}
 _ALLOWED_NAMES.update({"abs": abs, "round": round, "min": min, "max": max})
+_ALLOWED_NAMES = types.MappingProxyType(_ALLOWED_NAMES)  # read-only
+_EVAL_GLOBALS = {"__builtins__": {}}
 
 _ALLOWED_NODE_TYPES = (
     ast.Expression,
@@ -207,18 +326,13 @@ _ALLOWED_NODE_TYPES = (
     ast.Tuple,
     ast.List,
 )
+_ALLOWED_SET = frozenset(_ALLOWED_NODE_TYPES)
 
 
-def safe_eval(expr: str):
-    """Evaluate a math expression safely. Supports math functions."""
-    expr = expr.strip()
-    if not expr:
-        raise ValueError("Empty expression")
-    node = ast.parse(expr, mode="eval")
-
-    # Walk and validate nodes
+def _validate(node: ast.AST) -> None:
+    """Reject an expression at the first node that is not allowed (iterative: no recursion limit)."""
     for n in ast.walk(node):
-        if not isinstance(n, _ALLOWED_NODE_TYPES):
+        if type(n) not in _ALLOWED_SET:
             raise ValueError(f"Invalid expression: contains {type(n).__name__}")
 
         # If function call, ensure name allowed
@@ -233,51 +347,614 @@ def safe_eval(expr: str):
             if n.id not in _ALLOWED_NAMES:
                 raise ValueError(f"Use of name '{n.id}' not allowed")
 
-    compiled = compile(node, "<string>", "eval")
-    return eval(compiled, {"__builtins__": {}}, _ALLOWED_NAMES)
+
+@functools.lru_cache(maxsize=256)
+def _compile_safe(expr: str) -> types.CodeType:
+    """Parse, validate and compile a math expression (cached per unique expression)."""
+    if not expr:
+        raise ValueError("Empty expression")
+    node = ast.parse(expr, mode="eval")
+
+    _validate(node)
+    return compile(node, "<string>", "eval")
+
+
+# Plain arithmetic (digits, operators, parentheses) is evaluated by a small recursive-descent
+# parser with Python's precedence rules, skipping ast.parse/compile/eval entirely.
+_ARITH_CHARS = frozenset("0123456789 .+-*/%()")
+_RE_ARITH_TOKEN = re.compile(r"\s*(?:(\d+\.?\d*|\.\d+)|(\*\*|//|[-+*/%()]))")
+_ARITH_OPS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "//": operator.floordiv,
+    "%": operator.mod,
+}
+
+
+@functools.lru_cache(maxsize=256)
+def _fast_arith(expr: str):
+    """Evaluate plain arithmetic. Raises ValueError on anything it doesn't understand."""
+    tokens = []
+    pos = 0
+    while pos < len(expr):
+        m = _RE_ARITH_TOKEN.match(expr, pos)
+        if not m:
+            raise ValueError("Unsupported syntax")
+        num, op = m.groups()
+        if num is not None:
+            if num[0] == "0" and len(num) > 1 and num[1] != ".":
+                raise ValueError("Leading zeros")  # Python rejects these; let the AST path report it
+            tokens.append(float(num) if "." in num else int(num))
+        else:
+            tokens.append(op)
+        pos = m.end()
+    tokens.append(None)  # end marker
+    i = 0
+
+    def peek():
+        return tokens[i]
+
+    def take():
+        nonlocal i
+        i += 1
+        return tokens[i - 1]
+
+    def sum_():
+        v = term()
+        while peek() in ("+", "-"):
+            op = take()
+            v = _ARITH_OPS[op](v, term())
+        return v
+
+    def term():
+        v = unary()
+        while peek() in ("*", "/", "//", "%"):
+            op = take()
+            v = _ARITH_OPS[op](v, unary())
+        return v
+
+    def unary():
+        if peek() == "-":
+            take()
+            return -unary()
+        if peek() == "+":
+            take()
+            return +unary()
+        return power()
+
+    def power():
+        v = atom()
+        if peek() == "**":
+            take()
+            return v ** unary()  # right-associative; exponent may carry a sign
+        return v
+
+    def atom():
+        t = take()
+        if t == "(":
+            v = sum_()
+            if take() != ")":
+                raise ValueError("Unbalanced parentheses")
+            return v
+        if isinstance(t, (int, float)):
+            return t
+        raise ValueError("Unexpected token")
+
+    result = sum_()
+    if peek() is not None:
+        raise ValueError("Unexpected trailing input")
+    return result
+
+
+def safe_eval(expr: str):
+    """Evaluate a math expression safely. Supports math functions."""
+    expr = expr.strip()
+    if expr and _ARITH_CHARS.issuperset(expr):
+        try:
+            return _fast_arith(expr)
+        except Exception:
+            pass  # the AST path gives the result or the proper error
+    return eval(_compile_safe(expr), _EVAL_GLOBALS, _ALLOWED_NAMES)
 
 
 # ---------------------------
 # AI fallback & GK via Wikipedia
 # ---------------------------
+_AI_CACHE: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, reply)
+_AI_CACHE_LOCK = threading.Lock()
+
+# Persistent cache (survives restarts, shared by server workers) for Wikipedia summaries and,
+# in deterministic mode, AI answers. LFU eviction suits the long tail of GK lookups.
+_DISK_CACHE = None
+if diskcache:
+    try:
+        _DISK_CACHE = diskcache.Cache(
+            CONFIG["DISK_CACHE_DIR"], size_limit=50_000_000, eviction_policy="least-frequently-used"
+        )
+    except Exception:
+        _DISK_CACHE = None
+
+
+def _disk_get(key: str) -> Optional[str]:
+    if _DISK_CACHE is None:
+        return None
+    try:
+        return _DISK_CACHE.get(key)
+    except Exception:
+        return None
+
+
+def _disk_set(key: str, value: str) -> None:
+    if _DISK_CACHE is None:
+        return
+    try:
+        _DISK_CACHE.set(key, value, expire=CONFIG["DISK_CACHE_TTL"])
+    except Exception:
+        pass
+
+
+def _normalize(prompt: str) -> str:
+    """Cache key for a prompt: lowercased, stripped, whitespace collapsed."""
+    return " ".join(prompt.lower().split())
+
+
+# Semantic cache: normalized prompt embeddings stacked in one matrix; a new prompt whose
+# cosine similarity to a stored one reaches SEMANTIC_THRESHOLD reuses its answer.
+_SEM_LOCK = threading.Lock()
+_SEM_VECS = None  # np.ndarray (n, dim), rows L2-normalized
+_SEM_ENTRIES: list = []  # [reply, hits, expires_at] per row of _SEM_VECS
+
+
+@functools.lru_cache(maxsize=None)
+def _get_embedder():
+    """Load the sentence-embedding model on first use (imported lazily: it pulls in torch)."""
+    if not (CONFIG["SEMANTIC_CACHE"] and np is not None):
+        return None
+    try:
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(CONFIG["SEMANTIC_MODEL"])
+    except Exception:
+        return None
+
+
+@functools.lru_cache(maxsize=256)
+def _embed(text: str):
+    model = _get_embedder()
+    if model is None:
+        return None
+    return model.encode(text, normalize_embeddings=True)
+
+
+def _semantic_get(key: str) -> Optional[str]:
+    v = _embed(key)
+    if v is None:
+        return None
+    now = time.monotonic()
+    with _SEM_LOCK:
+        if not _SEM_ENTRIES:
+            return None
+        sims = _SEM_VECS @ v
+        for k, entry in enumerate(_SEM_ENTRIES):
+            if entry[2] < now:
+                sims[k] = -1.0  # expired rows never match; put() reuses them first
+        i = int(sims.argmax())
+        if sims[i] < CONFIG["SEMANTIC_THRESHOLD"]:
+            return None
+        _SEM_ENTRIES[i][1] += 1
+        return _SEM_ENTRIES[i][0]
+
+
+def _semantic_put(key: str, reply: str) -> None:
+    global _SEM_VECS
+    ttl = CONFIG["AI_CACHE_TTL"]
+    if ttl <= 0:
+        return
+    v = _embed(key)
+    if v is None:
+        return
+    now = time.monotonic()
+    with _SEM_LOCK:
+        if len(_SEM_ENTRIES) >= CONFIG["SEMANTIC_CACHE_SIZE"]:
+            # Evict an expired entry if there is one, else the least frequently hit
+            i = min(range(len(_SEM_ENTRIES)), key=lambda k: (_SEM_ENTRIES[k][2] >= now, _SEM_ENTRIES[k][1]))
+            del _SEM_ENTRIES[i]
+            _SEM_VECS = np.delete(_SEM_VECS, i, axis=0)
+        _SEM_ENTRIES.append([reply, 0, now + ttl])
+        _SEM_VECS = v[None, :] if _SEM_VECS is None or not len(_SEM_VECS) else np.vstack([_SEM_VECS, v])
+
+
+def _cache_get(key: str) -> Optional[str]:
+    cached = _cache_get_memory(key)
+    if cached is None:
+        cached = _cache_get_slow(key)
+    return cached
+
+
+def _cache_get_memory(key: str) -> Optional[str]:
+    with _AI_CACHE_LOCK:
+        hit = _AI_CACHE.get(key)
+        if hit is not None:
+            if hit[0] >= time.monotonic():
+                _AI_CACHE.move_to_end(key)
+                return hit[1]
+            del _AI_CACHE[key]
+    return None
+
+
+def _cache_get_slow(key: str) -> Optional[str]:
+    """Disk / semantic cache tiers. These block (sqlite, embedding model), so async callers
+    run this in a worker thread."""
+    if CONFIG["AI_DETERMINISTIC"]:
+        reply = _disk_get("ai:" + key)
+        if reply is not None:
+            _cache_put(key, reply)
+            return reply
+    if CONFIG["SEMANTIC_CACHE"]:
+        reply = _semantic_get(key)
+        if reply is not None:
+            _cache_put(key, reply)
+            return reply
+    return None
+
+
+async def _cache_get_async(key: str) -> Optional[str]:
+    cached = _cache_get_memory(key)
+    if cached is None and (CONFIG["AI_DETERMINISTIC"] or CONFIG["SEMANTIC_CACHE"]):
+        cached = await asyncio.to_thread(_cache_get_slow, key)
+    return cached
+
+
+def _cache_put(key: str, reply: str) -> None:
+    ttl = CONFIG["AI_CACHE_TTL"]
+    if ttl <= 0:
+        return
+    with _AI_CACHE_LOCK:
+        _AI_CACHE[key] = (time.monotonic() + ttl, reply)
+        _AI_CACHE.move_to_end(key)
+        while len(_AI_CACHE) > CONFIG["AI_CACHE_SIZE"]:
+            _AI_CACHE.popitem(last=False)
+
+
+def _persist_ai_reply(key: str, reply: str) -> None:
+    """Keep an answer from the AI endpoint (never a fallback) in the slow tiers: the semantic
+    cache and, in deterministic mode, the disk cache. May block; async callers use a thread."""
+    if not _is_cacheable(reply):
+        return
+    if CONFIG["AI_DETERMINISTIC"]:
+        _disk_set("ai:" + key, reply)
+    if CONFIG["SEMANTIC_CACHE"]:
+        _semantic_put(key, reply)
+
+
+def _is_cacheable(reply: str) -> bool:
+    return bool(reply) and not reply.startswith(("Sorry", "(empty"))
+
+
+_NO_ANSWER = "Sorry — I couldn't reach the AI, and have no quick answer."
+
+
 def ai_fallback(prompt: str) -> str:
-    """Try configured AI endpoint; if not available, fallback to wiki or simple echo."""
-    # Try HTTP AI endpoint
+    """Answer a prompt, serving repeated questions from an in-memory TTL cache."""
+    key = _normalize(prompt)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+    # Try configured AI endpoint; if not available, fallback to wiki or simple echo
+    reply = _ask_ai_batched(prompt)
+    if reply is not None:
+        _persist_ai_reply(key, reply)
+    else:
+        reply = _ask_wiki(prompt) or _NO_ANSWER
+    if _is_cacheable(reply):
+        _cache_put(key, reply)
+    return reply
+
+
+def ai_fallback_stream(prompt: str) -> Iterator[str]:
+    """Like ai_fallback, but yields the AI answer in chunks as the endpoint generates it."""
+    key = _normalize(prompt)
+    cached = _cache_get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    complete = False
+    try:
+        with _SESSION.post(
+            CONFIG["AI_ENDPOINT"],
+            json=_ai_payload(prompt, stream=True),
+            timeout=10,
+            stream=True,
+        ) as resp:
+            if resp.ok:
+                # Ollama streams one JSON object per line: {"response": "...", "done": false}
+                for line in resp.iter_lines():
+                    if not line:
+                        continue
+                    chunk = _json_loads(line)
+                    text = chunk.get("response")
+                    if text:
+                        parts.append(text)
+                        yield text
+                    if chunk.get("done"):
+                        break
+                complete = True
+    except Exception:
+        pass
+
+    if parts:
+        reply = "".join(parts)
+        if complete and _is_cacheable(reply):
+            _persist_ai_reply(key, reply)
+            _cache_put(key, reply)
+        return
+
+    reply = _ask_wiki(prompt) or _NO_ANSWER
+    if _is_cacheable(reply):
+        _cache_put(key, reply)
+    yield reply
+
+
+def _ask_ai(prompt: str) -> Optional[str]:
+    """Query the HTTP AI endpoint. Returns None if it is unreachable or errors."""
     try:
-        resp = requests.post(
+        resp = _SESSION.post(
             CONFIG["AI_ENDPOINT"],
-            json={"model": CONFIG["AI_MODEL"], "prompt": prompt, "stream": False},
+            json=_ai_payload(prompt, stream=False),
             timeout=10,
         )
         if resp.ok:
-            try:
-                j = resp.json()
-                # Common endpoints may return {"response": "..."} or {"text": "..."}
-                for k in ("response", "text", "output"):
-                    if k in j:
-                        return j[k]
-                return json.dumps(j)
-            except Exception:
-                return resp.text or "(empty AI response)"
+            return _parse_ai_reply(resp.content, resp.text)
     except Exception:
         pass
+    return None
 
-    # Wikipedia fallback (good for GK)
-    if CONFIG["WIKI_FALLBACK"]:
+
+def _ai_payload(prompt: str, stream: bool) -> dict:
+    payload = {"model": CONFIG["AI_MODEL"], "prompt": prompt, "stream": stream}
+    if CONFIG["AI_DETERMINISTIC"]:
+        payload["options"] = {"temperature": 0}
+    return payload
+
+
+def _parse_ai_reply(content: bytes, text: str) -> str:
+    try:
+        j = _json_loads(content)
+        # Ollama returns {"response": "..."}; other endpoints may use "text"/"output"
         try:
-            q = prompt.lower().strip()
-            q = re.sub(r"^(who is|what is|define|tell me about)\s+", "", q)
-            url = "https://en.wikipedia.org/api/rest_v1/page/summary/" + requests.utils.requote_uri(q)
-            r = requests.get(url, timeout=6)
-            if r.ok:
-                j = r.json()
-                extract = j.get("extract")
-                if extract:
-                    return extract
-        except Exception:
-            pass
+            return j["response"]
+        except KeyError:
+            for k in ("text", "output"):
+                if k in j:
+                    return j[k]
+        return json.dumps(j)
+    except Exception:
+        return text or "(empty AI response)"
+
+
+# Request coalescing: Ollama takes one prompt per call, so the win is deduplication. The
+# first caller for a normalized prompt makes the request; identical callers arriving while
+# it is in flight wait on its future instead of issuing their own.
+_INFLIGHT_SYNC: dict = {}  # normalized prompt -> concurrent.futures.Future
+_INFLIGHT_SYNC_LOCK = threading.Lock()
+_COALESCE_RESULT_TIMEOUT = 60
+
+
+def _ask_ai_batched(prompt: str) -> Optional[str]:
+    """_ask_ai with concurrent identical prompts sharing one request (direct when disabled)."""
+    if not CONFIG["AI_COALESCE"]:
+        return _ask_ai(prompt)
+    key = _normalize(prompt)
+    with _INFLIGHT_SYNC_LOCK:
+        fut = _INFLIGHT_SYNC.get(key)
+        owner = fut is None
+        if owner:
+            fut = concurrent.futures.Future()
+            _INFLIGHT_SYNC[key] = fut
+    if not owner:
+        try:
+            return fut.result(timeout=_COALESCE_RESULT_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            return None
+
+    reply = None
+    try:
+        reply = _ask_ai(prompt)
+    finally:
+        with _INFLIGHT_SYNC_LOCK:
+            del _INFLIGHT_SYNC[key]
+        fut.set_result(reply)
+    return reply
+
+
+def _ask_wiki(prompt: str) -> Optional[str]:
+    """Wikipedia summary lookup (good for GK). Returns None when there is no answer."""
+    if not CONFIG["WIKI_FALLBACK"]:
+        return None
+    q = _wiki_topic(prompt)
+    hit = _disk_get("wiki:" + q)
+    if hit:
+        return hit
+    try:
+        r = _SESSION.get(_wiki_url(q), timeout=6)
+        if r.ok:
+            extract = _json_loads(r.content).get("extract")
+            if extract:
+                _disk_set("wiki:" + q, extract)
+                return extract
+    except Exception:
+        pass
+    return None
+
+
+def _wiki_topic(prompt: str) -> str:
+    q = prompt.lower().strip()
+    return _RE_WIKI_PREFIX.sub("", q)
 
-    return "Sorry — I couldn't reach the AI, and have no quick answer."
+
+def _wiki_url(q: str) -> str:
+    return "https://en.wikipedia.org/api/rest_v1/page/summary/" + quote(q, safe="")
+
+
+# ---------------------------
+# Async AI path (used by the async web server)
+# ---------------------------
+# One module-scoped client so every request on the server's event loop shares its
+# keep-alive pool. HTTP/2 is used when the optional h2 package is installed.
+if httpx:
+    _ASYNC_CLIENT = httpx.AsyncClient(
+        http2=_HTTP2,
+        timeout=10,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        headers={"User-Agent": _SESSION.headers["User-Agent"], "Accept": "application/json"},
+    )
+    # Connection-specific headers are invalid over HTTP/2; httpx adds one by default
+    # (HTTP/1.1 connections are keep-alive without it anyway).
+    _ASYNC_CLIENT.headers.pop("Connection", None)
+else:
+    _ASYNC_CLIENT = None
+
+
+async def aclose_http() -> None:
+    """Close the async HTTP client (call on server shutdown)."""
+    if _ASYNC_CLIENT:
+        await _ASYNC_CLIENT.aclose()
+
+
+async def ai_fallback_async(prompt: str) -> str:
+    """Async ai_fallback: same cache and fallbacks, without blocking the event loop."""
+    if _ASYNC_CLIENT is None:
+        return await asyncio.to_thread(ai_fallback, prompt)
+    key = _normalize(prompt)
+    cached = await _cache_get_async(key)
+    if cached is not None:
+        return cached
+    reply = await _ask_ai_coalesced(prompt)
+    if reply is not None:
+        if CONFIG["AI_DETERMINISTIC"] or CONFIG["SEMANTIC_CACHE"]:
+            await asyncio.to_thread(_persist_ai_reply, key, reply)
+    else:
+        reply = await _ask_wiki_async(prompt) or _NO_ANSWER
+    if _is_cacheable(reply):
+        _cache_put(key, reply)
+    return reply
+
+
+async def ai_fallback_stream_async(prompt: str) -> AsyncIterator[str]:
+    """Async ai_fallback_stream: yields AI answer chunks as they arrive."""
+    if _ASYNC_CLIENT is None:
+        yield await asyncio.to_thread(ai_fallback, prompt)
+        return
+    key = _normalize(prompt)
+    cached = await _cache_get_async(key)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    complete = False
+    try:
+        async with _ASYNC_CLIENT.stream(
+            "POST",
+            CONFIG["AI_ENDPOINT"],
+            json=_ai_payload(prompt, stream=True),
+        ) as resp:
+            if resp.is_success:
+                async for line in resp.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = _json_loads(line)
+                    text = chunk.get("response")
+                    if text:
+                        parts.append(text)
+                        yield text
+                    if chunk.get("done"):
+                        break
+                complete = True
+    except Exception:
+        pass
+
+    if parts:
+        reply = "".join(parts)
+        if complete and _is_cacheable(reply):
+            if CONFIG["AI_DETERMINISTIC"] or CONFIG["SEMANTIC_CACHE"]:
+                await asyncio.to_thread(_persist_ai_reply, key, reply)
+            _cache_put(key, reply)
+        return
+
+    reply = await _ask_wiki_async(prompt) or _NO_ANSWER
+    if _is_cacheable(reply):
+        _cache_put(key, reply)
+    yield reply
+
+
+async def _ask_ai_async(prompt: str) -> Optional[str]:
+    try:
+        resp = await _ASYNC_CLIENT.post(
+            CONFIG["AI_ENDPOINT"],
+            json=_ai_payload(prompt, stream=False),
+        )
+        if resp.is_success:
+            return _parse_ai_reply(resp.content, resp.text)
+    except Exception:
+        pass
+    return None
+
+
+# Async request coalescing for the web server: the first request for a normalized prompt
+# starts a task right away; identical requests arriving while it runs await the same task.
+_INFLIGHT: dict = {}  # normalized prompt -> asyncio.Task
+_INFLIGHT_LOOP: Optional[asyncio.AbstractEventLoop] = None  # _INFLIGHT belongs to this loop
+_AI_TASKS: set = set()  # strong refs: the event loop only keeps weak references to tasks
+
+
+async def _ask_ai_coalesced(prompt: str) -> Optional[str]:
+    """_ask_ai_async with concurrent identical prompts sharing one request (direct when disabled)."""
+    global _INFLIGHT_LOOP
+    if not CONFIG["AI_COALESCE"]:
+        return await _ask_ai_async(prompt)
+    loop = asyncio.get_running_loop()
+    if loop is not _INFLIGHT_LOOP:
+        _INFLIGHT.clear()
+        _INFLIGHT_LOOP = loop
+    key = _normalize(prompt)
+    task = _INFLIGHT.get(key)
+    if task is None:
+        task = loop.create_task(_ask_ai_async(prompt))
+        _INFLIGHT[key] = task
+        _AI_TASKS.add(task)
+        task.add_done_callback(_AI_TASKS.discard)
+        task.add_done_callback(functools.partial(_forget_inflight, key))
+    # shield: one caller disconnecting must not cancel the answer for the others
+    return await asyncio.shield(task)
+
+
+def _forget_inflight(key: str, task: asyncio.Task) -> None:
+    if _INFLIGHT.get(key) is task:
+        del _INFLIGHT[key]
+
+
+async def _ask_wiki_async(prompt: str) -> Optional[str]:
+    if not CONFIG["WIKI_FALLBACK"]:
+        return None
+    q = _wiki_topic(prompt)
+    hit = await asyncio.to_thread(_disk_get, "wiki:" + q)
+    if hit:
+        return hit
+    try:
+        r = await _ASYNC_CLIENT.get(_wiki_url(q), timeout=6)
+        if r.is_success:
+            extract = _json_loads(r.content).get("extract")
+            if extract:
+                await asyncio.to_thread(_disk_set, "wiki:" + q, extract)
+                return extract
+    except Exception:
+        pass
+    return None
 
 
 # ---------------------------
@@ -288,11 +965,11 @@ def list_dir(path: str = ".") -> str:
     if not p.exists():
         return f"Path not found: {p}"
     try:
-        items = list(p.iterdir())
-        lines = []
-        for it in items:
-            lines.append(f"{it.name}/" if it.is_dir() else it.name)
-        return "\n".join(lines) or "(empty)"
+        # scandir's DirEntry.is_dir() uses the type from the directory listing (no stat per entry)
+        with os.scandir(p) as it:
+            return "\n".join(f"{e.name}/" if e.is_dir() else e.name for e in it) or "(empty)"
+    except PermissionError:
+        return f"Permission denied: {p}"
     except Exception as e:
         return f"Failed listing: {e}"
 
@@ -326,7 +1003,6 @@ def delete_path(path: str) -> str:
         return f"Path not found: {p}"
     try:
         if p.is_dir():
-            import shutil
             shutil.rmtree(p)
         else:
             p.unlink()
@@ -340,9 +1016,9 @@ def delete_path(path: str) -> str:
 # ---------------------------
 def _do_system_shutdown() -> str:
     try:
-        if platform.system() == "Windows":
+        if _IS_WINDOWS:
             subprocess.Popen(["shutdown", "/s", "/t", "5"])
-        elif platform.system() == "Darwin":
+        elif _IS_DARWIN:
             subprocess.Popen(["sudo", "shutdown", "-h", "now"])
         else:
             subprocess.Popen(["shutdown", "-h", "now"])
@@ -353,9 +1029,9 @@ def _do_system_shutdown() -> str:
 
 def _do_system_restart() -> str:
     try:
-        if platform.system() == "Windows":
+        if _IS_WINDOWS:
             subprocess.Popen(["shutdown", "/r", "/t", "5"])
-        elif platform.system() == "Darwin":
+        elif _IS_DARWIN:
             subprocess.Popen(["sudo", "shutdown", "-r", "now"])
         else:
             subprocess.Popen(["reboot"])
@@ -369,119 +1045,224 @@ def require_confirm_for_web(command: str, text: str) -> Optional[str]:
     For non-interactive callers, require the CONFIRM_TOKEN in the text to allow destructive ops.
     Returns None if allowed, otherwise a message explaining how to confirm.
     """
-    token = CONFIG["CONFIRM_TOKEN"]
-    if token and token in text:
-        return None
-    return f"Action requires confirmation. Append the confirmation token '{token}' to your command to proceed."
+    return None if _CONFIRM_TOKEN and _CONFIRM_TOKEN in text else _CONFIRM_MSG
 
 
 # ---------------------------
 # Main command parser
 # ---------------------------
-def process_command_return(text: str) -> str:
+# Handlers keyed by the command's first word. Each takes the original command and the
+# text after the first word; returning None means "not mine", so parsing falls through.
+def _handle_open(c: str, rest: str) -> Optional[str]:
+    target = rest.strip()
+    if not target:
+        return None
+    # if looks like a URL or contains dot/slash -> open as is
+    return open_website(target) if (("." in target) or ("/" in target) or (" " not in target and not target.isalpha())) else open_local(target)
+
+
+def _handle_play(c: str, rest: str) -> Optional[str]:
+    if not rest:
+        return None
+    return play_music(rest.strip())
+
+
+def _handle_copy(c: str, rest: str) -> Optional[str]:
+    if not rest:
+        return None
+    return clipboard_copy(rest.strip())
+
+
+def _handle_paste(c: str, rest: str) -> Optional[str]:
+    if rest.strip().lower() in ("", "clipboard"):
+        return clipboard_paste()
+    return None
+
+
+def _handle_list(c: str, rest: str) -> Optional[str]:
+    arg = rest.strip()
+    return list_dir(arg) if arg else None
+
+
+def _handle_create(c: str, rest: str) -> Optional[str]:
+    if not rest.lower().startswith("file "):
+        return None
+    parts = c.split(" ", 2)
+    if len(parts) >= 3:
+        path = parts[2]
+        return make_file(path)
+    return "Usage: create file <path> [content]"
+
+
+def _handle_move(c: str, rest: str) -> Optional[str]:
+    if not rest:
+        return None
+    # move <src> to <dst>
+    m = _RE_MOVE.match(c)
+    if m:
+        return move_file(m.group(1), m.group(2))
+    return "Usage: move <src> to <dst>"
+
+
+def _handle_delete(c: str, rest: str) -> Optional[str]:
+    if not rest:
+        return None
+    target = rest.strip()
+    # require confirmation token for web
+    confirm = require_confirm_for_web("delete", c)
+    if confirm:
+        return confirm
+    return delete_path(target)
+
+
+def _handle_calc(c: str, rest: str) -> Optional[str]:
+    if not rest:
+        return None
+    expr = rest
+    try:
+        res = safe_eval(expr)
+        return f"{expr} = {res}"
+    except Exception as e:
+        return f"Calculation error: {e}"
+
+
+def _handle_shutdown(c: str) -> str:
+    if not CONFIG["ALLOW_SYSTEM_COMMANDS"]:
+        return "System command disabled in config."
+    confirm = require_confirm_for_web("shutdown", c)
+    if confirm:
+        return confirm
+    return _do_system_shutdown()
+
+
+def _handle_restart(c: str) -> str:
+    if not CONFIG["ALLOW_SYSTEM_COMMANDS"]:
+        return "System command disabled in config."
+    confirm = require_confirm_for_web("restart", c)
+    if confirm:
+        return confirm
+    return _do_system_restart()
+
+
+def _say_time() -> str:
+    return datetime.now().strftime("The time is %I:%M %p")
+
+
+def _say_date() -> str:
+    return datetime.now().strftime("Today is %A, %B %d, %Y")
+
+
+# Fixed commands answered straight from a dict lookup, before any parsing
+_DIRECT = {
+    "time": _say_time,
+    "what time is it": _say_time,
+    "date": _say_date,
+    "what is the date": _say_date,
+    "paste": clipboard_paste,
+    "paste clipboard": clipboard_paste,
+    "screenshot": take_screenshot,
+    "take screenshot": take_screenshot,
+    "open youtube": lambda: open_website("https://youtube.com"),
+    "open google": lambda: open_website("https://google.com"),
+    "open github": lambda: open_website("https://github.com"),
+    "open linkedin": lambda: open_website("https://linkedin.com"),
+}
+
+_FIRST_TOKEN_HANDLERS = {
+    "open": _handle_open,
+    "launch": _handle_open,
+    "start": _handle_open,
+    "play": _handle_play,
+    "copy": _handle_copy,
+    "paste": _handle_paste,
+    "list": _handle_list,
+    "create": _handle_create,
+    "move": _handle_move,
+    "delete": _handle_delete,
+    "calc": _handle_calc,
+    "calculate": _handle_calc,
+}
+
+# Keywords that trigger an action wherever they appear in the command
+_KEYWORDS = frozenset(("screenshot", "time", "date", "shutdown", "restart"))
+_RE_WORD = re.compile(r"[a-z]+")
+
+
+def process_command_return(text: str) -> Union[str, Iterator[str]]:
     """
     Non-interactive command handler (suitable for web UI).
-    Returns a string reply. Destructive/system actions require CONFIRM_TOKEN to be present.
+    Returns a string reply, or an iterator of reply chunks for AI answers when AI_STREAM is on.
+    Destructive/system actions require CONFIRM_TOKEN to be present.
     """
     if not text:
         return "No command provided."
     c = text.strip()
+    reply = _dispatch_local(c)
+    if reply is not None:
+        return reply
 
-    # Lower for pattern matching
-    lc = c.lower()
+    # Anything else (GK questions included) -> AI fallback
+    if CONFIG["AI_STREAM"]:
+        return ai_fallback_stream(c)
+    return ai_fallback(c)
 
-    # 1) Open URL, search or app
-    m = re.match(r"^(open|launch|start)\s+(.+)$", lc)
-    if m:
-        target = c.split(" ", 1)[1].strip()
-        # if looks like a URL or contains dot/slash -> open as is
-        return open_website(target) if (("." in target) or ("/" in target) or (" " not in target and not target.isalpha())) else open_local(target)
-
-    # 2) Play music
-    if lc.startswith("play "):
-        song = c[5:].strip()
-        return play_music(song)
-
-    # 3) Clipboard operations
-    if lc.startswith("copy "):
-        content = c[5:].strip()
-        return clipboard_copy(content)
-    if lc in ("paste", "paste clipboard"):
-        return clipboard_paste()
 
-    # 4) Screenshot
-    if "screenshot" in lc or "take screenshot" in lc:
-        return take_screenshot()
-
-    # 5) File operations
-    if lc.startswith("list "):
-        arg = c.split(" ", 1)[1].strip()
-        return list_dir(arg)
-    if lc.startswith("create file "):
-        parts = c.split(" ", 2)
-        if len(parts) >= 3:
-            path = parts[2]
-            return make_file(path)
-        return "Usage: create file <path> [content]"
-    if lc.startswith("move "):
-        # move <src> to <dst>
-        m = re.match(r"move\s+(.+?)\s+to\s+(.+)", c, flags=re.I)
-        if m:
-            return move_file(m.group(1), m.group(2))
-        return "Usage: move <src> to <dst>"
-    if lc.startswith("delete "):
-        target = c.split(" ", 1)[1].strip()
-        # require confirmation token for web
-        confirm = require_confirm_for_web("delete", c)
-        if confirm:
-            return confirm
-        return delete_path(target)
-
-    # 6) Time / Date
-    if "time" in lc and "date" not in lc:
-        return datetime.now().strftime("The time is %I:%M %p")
-    if "date" in lc:
-        return datetime.now().strftime("Today is %A, %B %d, %Y")
-
-    # 7) System commands (dangerous)
-    if "shutdown" in lc:
-        if not CONFIG["ALLOW_SYSTEM_COMMANDS"]:
-            return "System command disabled in config."
-        confirm = require_confirm_for_web("shutdown", c)
-        if confirm:
-            return confirm
-        return _do_system_shutdown()
-    if "restart" in lc:
-        if not CONFIG["ALLOW_SYSTEM_COMMANDS"]:
-            return "System command disabled in config."
-        confirm = require_confirm_for_web("restart", c)
-        if confirm:
-            return confirm
-        return _do_system_restart()
-
-    # 8) Calculator: explicit command
-    if lc.startswith("calc ") or lc.startswith("calculate "):
-        expr = c.split(" ", 1)[1]
-        try:
-            res = safe_eval(expr)
-            return f"{expr} = {res}"
-        except Exception as e:
-            return f"Calculation error: {e}"
+async def process_command_return_async(text: str) -> Union[str, AsyncIterator[str]]:
+    """Async process_command_return: local actions run in a worker thread, AI calls are awaited."""
+    if not text:
+        return "No command provided."
+    c = text.strip()
+    reply = await asyncio.to_thread(_dispatch_local, c)
+    if reply is not None:
+        return reply
 
-    # 9) Direct math expression
-    if re.match(r"^[0-9\.\+\-\*\/\%\(\)\s\^e]+$", lc) or re.search(r"\b(sin|cos|tan|log|sqrt|pi|e)\b", lc):
+    if CONFIG["AI_STREAM"]:
+        return ai_fallback_stream_async(c)
+    return await ai_fallback_async(c)
+
+
+def _dispatch_local(c: str) -> Optional[str]:
+    """Run a command that can be handled locally. Returns None if it should go to the AI."""
+    # Lower for pattern matching
+    lc = c.lower()
+
+    # 0) Exact fixed commands
+    fn = _DIRECT.get(lc)
+    if fn:
+        return fn()
+
+    # 1) Commands identified by their first word (open, play, copy, files, calc, ...)
+    first, _, rest = c.partition(" ")
+    handler = _FIRST_TOKEN_HANDLERS.get(first.lower())
+    if handler:
+        reply = handler(c, rest)
+        if reply is not None:
+            return reply
+
+    # 2) Keywords anywhere in the command: screenshot, time/date, system commands
+    words = _KEYWORDS.intersection(_RE_WORD.findall(lc))
+    if words:
+        if "screenshot" in words:
+            return take_screenshot()
+        if "time" in words and "date" not in words:
+            return _say_time()
+        if "date" in words:
+            return _say_date()
+        # System commands (dangerous)
+        if "shutdown" in words:
+            return _handle_shutdown(c)
+        if "restart" in words:
+            return _handle_restart(c)
+
+    # 3) Direct math expression
+    if (lc and not lc.translate(_MATH_TRANS)) or _RE_MATHFUNC.search(lc):
         try:
             res = safe_eval(c)
             return f"{c} = {res}"
         except Exception:
             pass  # fall through to AI
 
-    # 10) Small GK / question-like requests -> AI fallback
-    if any(k in lc for k in ("who", "what", "when", "where", "how", "define", "explain", "?")):
-        return ai_fallback(c)
-
-    # 11) If nothing matched, try AI fallback
-    return ai_fallback(c)
+    return None
 
 
 # Interactive version that can ask confirm for dangerous ops
@@ -491,6 +1272,8 @@ def process_command(text: str) -> None:
     for destructive commands when running in terminal/CLI.
     """
     reply = process_command_return(text)
+    if not isinstance(reply, str):
+        reply = "".join(reply)
 
     # If the return indicates confirmation required, and we're interactive, prompt the user
     if isinstance(reply, str) and "requires confirmation" in reply.lower():
@@ -503,9 +1286,10 @@ def process_command(text: str) -> None:
             ans = "no"
         if ans == "yes":
             # re-run but this time allow by inserting token
-            token = CONFIG["CONFIRM_TOKEN"]
-            new_text = text + " " + token
+            new_text = text + " " + _CONFIRM_TOKEN
             final_reply = process_command_return(new_text)
+            if not isinstance(final_reply, str):
+                final_reply = "".join(final_reply)
             speak(final_reply)
             return
         else:
@@ -523,11 +1307,11 @@ if __name__ == "__main__":
         try:
             cmd = input("Vex> ").strip()
         except (KeyboardInterrupt, EOFError):
-            speak("Goodbye.")
+            speak("Goodbye.", block=True)
             break
         if not cmd:
             continue
         if cmd.lower() in ("exit", "quit"):
-            speak("Goodbye.")
+            speak("Goodbye.", block=True)
             break
         process_command(cmd)
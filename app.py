@@ -1,54 +1,70 @@
 import os
 import sys
+import json
 import traceback
+import subprocess
 import importlib
-from flask import Flask, request, jsonify, send_from_directory
+from quart import Quart, Response, request, jsonify, send_from_directory
 
 STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+_IS_NT = os.name == "nt"
 
-app = Flask(
+app = Quart(
     __name__,
     static_folder=STATIC_DIR,
     static_url_path="",
 )
 
-process_command_return = None
+ai = None
+process_command_return_async = None
 try:
     ai = importlib.import_module("ai_assistant")
-    process_command_return = getattr(ai, "process_command_return", None)
-    print("ai_assistant imported:", bool(process_command_return))
+    process_command_return_async = getattr(ai, "process_command_return_async", None)
+    print("ai_assistant imported:", bool(process_command_return_async))
 except Exception as e:
     print("Failed to import ai_assistant:", e, file=sys.stderr)
     traceback.print_exc()
 
+@app.after_serving
+async def close_http():
+    if ai is not None and hasattr(ai, "aclose_http"):
+        await ai.aclose_http()
+
 @app.route("/health")
-def health():
-    return jsonify({"ok": True, "ai_available": bool(process_command_return)})
+async def health():
+    return jsonify({"ok": True, "ai_available": bool(process_command_return_async)})
 
 @app.route("/", methods=["GET"])
-def index():
-    return send_from_directory(STATIC_DIR, "index.html")
+async def index():
+    return await send_from_directory(STATIC_DIR, "index.html")
 
 @app.route("/<path:filename>")
-def static_files(filename):
+async def static_files(filename):
     file_path = os.path.join(STATIC_DIR, filename)
     if os.path.isfile(file_path):
-        return send_from_directory(STATIC_DIR, filename)
-    return send_from_directory(STATIC_DIR, "index.html")
+        return await send_from_directory(STATIC_DIR, filename)
+    return await send_from_directory(STATIC_DIR, "index.html")
+
+async def _sse(chunks):
+    async for chunk in chunks:
+        yield f"data: {json.dumps(chunk)}\n\n"
 
 @app.route("/api/command", methods=["POST"])
-def api_command():
+async def api_command():
     try:
-        data = request.get_json() or {}
+        data = await request.get_json(silent=True) or {}
         cmd = data.get("command", "").strip()
         if not cmd:
             return jsonify({"reply": "Please provide a command."}), 400
 
-        if not process_command_return:
+        if not process_command_return_async:
             return jsonify({"reply": "Assistant module not available on server (check logs)."}), 500
 
         try:
-            reply = process_command_return(cmd)
+            reply = await process_command_return_async(cmd)
+            if not isinstance(reply, str):
+                # Streamed AI answer: forward chunks as server-sent events
+                return Response(_sse(reply), mimetype="text/event-stream")
             return jsonify({"reply": reply}), 200
         except Exception as e:
             tb = traceback.format_exc()
@@ -60,16 +76,14 @@ def api_command():
         return jsonify({"reply": "Unexpected server error handling request."}), 500
 
 @app.route("/api/launch", methods=["POST"])
-def api_launch():
+async def api_launch():
     assistant_path = os.path.join(os.getcwd(), "ai_assistant.py")
     if not os.path.exists(assistant_path):
         return jsonify({"status": "ai_assistant.py not found"}), 404
     try:
-        if os.name == "nt":
-            import subprocess
+        if _IS_NT:
             subprocess.Popen([sys.executable, assistant_path], creationflags=subprocess.CREATE_NEW_CONSOLE)
         else:
-            import subprocess, signal
             subprocess.Popen([sys.executable, assistant_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, preexec_fn=os.setpgrp)
         return jsonify({"status": "Launched ai_assistant.py (dev)"}), 200
     except Exception as e:
@@ -78,4 +92,6 @@ def api_launch():
 
 
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    # Development server; debugger and reloader only when JARVIS_DEV is set. Use asgi.py in production.
+    dev = bool(os.environ.get("JARVIS_DEV"))
+    app.run(debug=dev, use_reloader=dev, host="0.0.0.0", port=5000)
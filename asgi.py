@@ -0,0 +1,6 @@
+"""
+ASGI entrypoint for running the web app under a production server, e.g.
+
+    hypercorn asgi:app --workers 4 --bind 0.0.0.0:5000 --keep-alive 30
+"""
+from app import app  # noqa: F401
@@ -26,6 +26,30 @@ document.addEventListener("DOMContentLoaded", () => {
         body: JSON.stringify({ command: cmd })
       });
 
+      if (res.ok && (res.headers.get("Content-Type") || "").startsWith("text/event-stream")) {
+        // Streamed AI answer: each "data:" event carries a JSON-encoded text chunk
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buf = "", reply = "";
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          buf += decoder.decode(value, { stream: true });
+          let sep;
+          while ((sep = buf.indexOf("\n\n")) !== -1) {
+            const event = buf.slice(0, sep);
+            buf = buf.slice(sep + 2);
+            if (event.startsWith("data: ")) {
+              reply += JSON.parse(event.slice(6));
+              showReply(reply, false);
+            }
+          }
+        }
+        if (!reply) showReply("(no reply)", false);
+        console.log("Jarvis reply:", reply);
+        return;
+      }
+
       const text = await res.text(); 
       let data;
       try { data = JSON.parse(text); } catch (e) { data = null; }